@@ -4,52 +4,104 @@ import json
 import argparse
 import sys
 import re
+import functools
 from datetime import datetime
+from html import escape as _esc
 
 TONERS  = ["Cyan", "Magenta", "Yellow", "Black"]
 DRAWERS = ["Drawer 1", "Drawer 2", "Drawer 3", "Drawer 4"]
 
-def pct_to_int_safe(v):
+TD_PLAIN     = "<td>"
+TD_EMPTY     = "<td class='empty-paper'>"
+TD_ONE_BAR   = "<td class='one-bar'>"
+TD_TWO_BAR   = "<td class='two-bar'>"
+TD_LOW_TONER = "<td class='low-toner'>"
+# Drawer statuses as emitted by core.parse_paper; anything else goes through paper_td_open()
+TD_OPEN_BY_STATUS = {"Empty": TD_EMPTY, "1 Bar": TD_ONE_BAR, "2 Bar": TD_TWO_BAR, "3 Bar": TD_PLAIN, "N/A": TD_PLAIN}
+# Whole-cell %-templates (cheaper than str.format per cell), keyed by the opening <td> they start with
+CELL_TPL = {td: td + "%s</td>" for td in (TD_PLAIN, TD_EMPTY, TD_ONE_BAR, TD_TWO_BAR, TD_LOW_TONER)}
+TONER_TPL     = "<td>%d%%</td>"
+LOW_TONER_TPL = "<td class='low-toner'>%d%%</td>"
+# Prebuilt cells for the values core.py actually emits: 0-100% toner and the canonical drawer statuses
+TONER_CELLS = tuple((LOW_TONER_TPL if n <= 10 else TONER_TPL) % n for n in range(101))
+PAPER_CELL_BY_STATUS = {s: (td, CELL_TPL[td] % s) for s, td in TD_OPEN_BY_STATUS.items()}
+
+_WS_RE  = re.compile(r"\s+")
+_INT_RE = re.compile(r"-?\d+")
+_BAR_RE = re.compile(r"\b([123])\s*bar\b")
+# bar counts for the drawer strings core.parse_paper emits, checked before any normalising
+BARS_BY_STATUS = {"Empty": 0, "1 Bar": 1, "2 Bar": 2, "3 Bar": 3, "N/A": None}
+
+def pct_to_int_safe(v, _int=int, _isinstance=isinstance):
     if v is None:
         return None
-    if isinstance(v, (int, float)):
-        return int(v)
-    s = str(v).strip()
-    if not s or s.upper() == "N/A":
+    if _isinstance(v, (int, float)):
+        return _int(v)
+    s = v.strip() if _isinstance(v, str) else str(v).strip()
+    if not s or s[0] == "N" or s[0] == "n":  # "N/A"
         return None
     s = s.rstrip("%").strip()
-    return int(s) if re.fullmatch(r"-?\d+", s) else None
+    if s.isdecimal():
+        return _int(s)
+    return _int(s) if _INT_RE.fullmatch(s) else None
+
+@functools.lru_cache(maxsize=1024)
+def _norm_str(s: str) -> str:
+    return _WS_RE.sub(" ", s.replace("\xa0", " ")).strip().lower()
 
 def norm_text(x: str) -> str:
-    # normalize whitespace and case
-    return re.sub(r"\s+", " ", (str(x or "").replace("\xa0", " "))).strip().lower()
+    # normalize whitespace and case; the fleet only ever reports a handful of distinct values
+    return _norm_str(x if isinstance(x, str) else str(x or ""))
 
 def is_empty_text(txt) -> bool:
     t = norm_text(txt)
     return bool(t) and (t.startswith("0") or "empty" in t or "no paper" in t)
 
 def bars_from_text(txt):
+    if isinstance(txt, str) and txt in BARS_BY_STATUS:
+        return BARS_BY_STATUS[txt]
     t = norm_text(txt)
     if not t or t in {"n/a", "na", "-", "—"}:
         return None
     if is_empty_text(t):
         return 0
-    m = re.search(r"\b([123])\s*bar\b", t)
+    m = _BAR_RE.search(t)
     if m:
         return int(m.group(1))
-    if re.fullmatch(r"[123]", t):
+    if t in ("1", "2", "3"):
         return int(t)
     return None
 
-def build_html(rows, banner_src="vcutsbanner.png", title="Printer Status"):
+def paper_td_open(raw) -> str:
+    # opening <td> for a drawer cell; anything but TD_PLAIN needs attention
+    td = TD_OPEN_BY_STATUS.get(raw) if isinstance(raw, str) else None
+    if td is not None:
+        return td
+    t = norm_text(raw)
+    if t == "empty" or t == "no paper" or t.startswith("0") or "empty" in t or "no paper" in t:
+        return TD_EMPTY
+    b = bars_from_text(raw)
+    if b == 1:
+        return TD_ONE_BAR
+    if b == 2:
+        return TD_TWO_BAR
+    return TD_PLAIN
+
+def build_html_iter(rows, banner_src="vcutsbanner.png", title="Printer Status"):
+    # yields the report in fragments so callers can stream it to a file
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     include_address = any((p.get("address") or "").strip() for p in rows)
     attention_rows = []
+    errors = []
+    # locals for names the row loop touches on every cell
+    _p2i = pct_to_int_safe
+    _T, _D = TONERS, DRAWERS
+    status_cell = PAPER_CELL_BY_STATUS.get
 
-    html = f"""<html>
+    yield f"""<html>
 <head>
   <meta charset="utf-8"/>
-  <title>{title}</title>
+  <title>{_esc(title)}</title>
   <style>
     body {{ font-family: Arial, sans-serif; margin:0; padding:0; background:#f8f9fa; }}
     .header {{ background:#000; color:#FEC52E; padding:20px; text-align:center; position:relative; }}
@@ -74,7 +126,7 @@ def build_html(rows, banner_src="vcutsbanner.png", title="Printer Status"):
 </head>
 <body>
   <div class="header">
-    <img src="{banner_src}" alt="VCU Technology Services">
+    <img src="{_esc(banner_src)}" alt="VCU Technology Services">
     <h1>VCU Technology Services Printer Status Report</h1>
     <div class="timestamp">{ts}</div>
   </div>
@@ -84,8 +136,8 @@ def build_html(rows, banner_src="vcutsbanner.png", title="Printer Status"):
         <tr>
           <th>Printer</th>"""
     if include_address:
-        html += "<th>Address</th>"
-    html += """
+        yield "<th>Address</th>"
+    yield """
           <th class='cyan'>Cyan</th>
           <th class='magenta'>Magenta</th>
           <th class='yellow'>Yellow</th>
@@ -99,110 +151,96 @@ def build_html(rows, banner_src="vcutsbanner.png", title="Printer Status"):
       <tbody>
 """
 
-    # Main table and collect attention-needed in one pass
+    # Main table, attention-needed and errors in one pass
     for p in rows:
-        name  = p.get("name", "Unknown")
-        url   = p.get("url") or "#"
-        addr  = (p.get("address") or "").strip()
-        toner = p.get("toner", {})
-        paper = p.get("paper", {})
-
-        html += "<tr>"
-        html += f"<td class='printer-name'><a href='{url}'>{name}</a></td>"
+        pget  = p.get
+        name  = pget("name", "Unknown")
+        url   = pget("url") or "#"
+        addr  = (pget("address") or "").strip()
+        tget  = (pget("toner") or {}).get
+        paper_get = (pget("paper") or {}).get
+
+        # escape once per row; each row is emitted as a single fragment
+        e_name = _esc(str(name))
+        e_addr = _esc(addr)
+        cells = ["<tr><td class='printer-name'><a href='", _esc(str(url)), "'>", e_name, "</a></td>"]
         if include_address:
-            html += f"<td>{addr or '-'}</td>"
+            cells += ("<td>", e_addr or "-", "</td>")
 
         # Toner (<=10% or 'empty' or '0%') -> red
-        for color in TONERS:
-            raw = toner.get(color, "N/A")
-            n = pct_to_int_safe(raw)
+        for color in _T:
+            raw = tget(color, "N/A")
+            # fast path for the "NN%" strings core.py emits
+            s = raw[:-1] if isinstance(raw, str) and raw.endswith("%") else raw
+            n = int(s) if isinstance(s, str) and s.isdecimal() else _p2i(raw)
             if n is not None:
-                html += f"<td class='low-toner'>{n}%</td>" if n <= 10 else f"<td>{n}%</td>"
+                cells.append(TONER_CELLS[n] if 0 <= n <= 100 else (LOW_TONER_TPL if n <= 10 else TONER_TPL) % n)
             else:
                 txt = str(raw)
-                html += f"<td class='low-toner'>{txt}</td>" if "empty" in norm_text(txt) or norm_text(txt) == "0%" else f"<td>{txt}</td>"
+                t = norm_text(txt)
+                low = "empty" in t or t == "0%"
+                cells.append(CELL_TPL[TD_LOW_TONER if low else TD_PLAIN] % _esc(txt))
 
         # Drawers (ultra-strict empty detection → red + include in attention)
-        any_low = False
-        for d in DRAWERS:
-            raw = paper.get(d, "N/A")
-            t = norm_text(raw)
-            is_hard_empty = (t == "empty" or t == "no paper" or t.startswith("0") or "empty" in t or "no paper" in t)
-            if is_hard_empty:
-                any_low = True
-                html += f"<td class='empty-paper'>{raw}</td>"
-                continue
-            b = bars_from_text(raw)
-            if b is None:
-                html += f"<td>{raw}</td>"
-            elif b == 1:
-                any_low = True
-                html += f"<td class='one-bar'>{raw}</td>"
-            elif b == 2:
-                any_low = True
-                html += f"<td class='two-bar'>{raw}</td>"
+        any_low = drawers_empty = False
+        drawer_cells = []
+        for raw in [paper_get(d, "N/A") for d in _D]:
+            hit = status_cell(raw) if isinstance(raw, str) else None
+            if hit:
+                td, cell = hit
             else:
-                html += f"<td>{raw}</td>"
-        html += "</tr>"
+                td = paper_td_open(raw)
+                cell = CELL_TPL[td] % _esc(str(raw))
+            if td is not TD_PLAIN:
+                any_low = True
+                if td is TD_EMPTY:
+                    drawers_empty = True
+            drawer_cells.append(cell)
+        cells += drawer_cells
+        cells.append("</tr>")
+        yield "".join(cells)
+
+        # Errors — drop 'No paper' when only MPT is empty
+        for e in (pget("errors") or []):
+            if "no paper" in str(e).lower() and not drawers_empty:
+                continue  # ignore MPT-only "No paper."
+            errors.append(f"{e_name}: {_esc(str(e))}")
 
         if any_low:
-            attention_rows.append({
-                "name": name,
-                "addr": addr,
-                "vals": [paper.get(d, "N/A") for d in DRAWERS]
-            })
+            # the Attention table repeats these drawer cells verbatim, so keep the rendered ones
+            attention_rows.append((e_name, e_addr, drawer_cells))
 
-    html += "</tbody></table>"
+    yield "</tbody></table>"
 
     # Attention Needed table
     if attention_rows:
-        html += "<h2>Attention Needed: Low Paper Levels</h2>"
-        html += "<table class='printer-table'><thead><tr><th>Printer</th>"
+        yield "<h2>Attention Needed: Low Paper Levels</h2>"
+        yield "<table class='printer-table'><thead><tr><th>Printer</th>"
         if include_address:
-            html += "<th>Address</th>"
-        html += "<th>Drawer 1</th><th>Drawer 2</th><th>Drawer 3</th><th>Drawer 4</th></tr></thead><tbody>"
-        for r in attention_rows:
-            html += "<tr>"
-            html += f"<td class='printer-name'>{r['name']}</td>"
+            yield "<th>Address</th>"
+        yield "<th>Drawer 1</th><th>Drawer 2</th><th>Drawer 3</th><th>Drawer 4</th></tr></thead><tbody>"
+        for e_name, e_addr, drawer_cells in attention_rows:
+            cells = ["<tr><td class='printer-name'>", e_name, "</td>"]
             if include_address:
-                html += f"<td>{r['addr'] or '-'}</td>"
-            for raw in r["vals"]:
-                t = norm_text(raw)
-                is_hard_empty = (t == "empty" or t == "no paper" or t.startswith("0") or "empty" in t or "no paper" in t)
-                if is_hard_empty:
-                    html += f"<td class='empty-paper'>{raw}</td>"
-                    continue
-                b = bars_from_text(raw)
-                if b is None:
-                    html += f"<td>{raw}</td>"
-                elif b == 1:
-                    html += f"<td class='one-bar'>{raw}</td>"
-                elif b == 2:
-                    html += f"<td class='two-bar'>{raw}</td>"
-                else:
-                    html += f"<td>{raw}</td>"
-            html += "</tr>"
-        html += "</tbody></table>"
-
-    # Errors — drop 'No paper' when only MPT is empty
-    errors = []
-    for p in rows:
-        name  = p.get("name", "Unknown")
-        paper = p.get("paper", {})
-        drawers_empty = any(is_empty_text(paper.get(d)) for d in DRAWERS)
-        for e in (p.get("errors") or []):
-            if "no paper" in str(e).lower() and not drawers_empty:
-                continue  # ignore MPT-only "No paper."
-            errors.append(f"{name}: {e}")
+                cells += ("<td>", e_addr or "-", "</td>")
+            cells += drawer_cells
+            cells.append("</tr>")
+            yield "".join(cells)
+        yield "</tbody></table>"
 
-    html += "<h2>Errors</h2>"
+    yield "<h2>Errors</h2>"
     if errors:
-        html += "<ul class='alert'>" + "".join(f"<li>{x}</li>" for x in errors) + "</ul>"
+        yield "<ul class='alert'>"
+        for x in errors:
+            yield f"<li>{x}</li>"
+        yield "</ul>"
     else:
-        html += "<p>No errors reported.</p>"
+        yield "<p>No errors reported.</p>"
 
-    html += "\n  </div>\n</body>\n</html>"
-    return html
+    yield "\n  </div>\n</body>\n</html>"
+
+def build_html(rows, banner_src="vcutsbanner.png", title="Printer Status"):
+    return "".join(build_html_iter(rows, banner_src=banner_src, title=title))
 
 def main():
     ap = argparse.ArgumentParser(description="Render an HTML page from printers.json (produced by app.py)")
@@ -221,9 +259,8 @@ def main():
         if not isinstance(rows, list):
             raise ValueError("Input JSON must be a list of printer objects")
 
-    html = build_html(rows, banner_src=args.banner, title=args.title)
-    with open(args.output, "w", encoding="utf-8") as f:
-        f.write(html)
+    with open(args.output, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.writelines(build_html_iter(rows, banner_src=args.banner, title=args.title))
 
     print(f"Report saved to {os.path.abspath(args.output)}")
 
@@ -1,65 +1,156 @@
 # core.py
 from __future__ import annotations
 import concurrent.futures as futures
-import json, re, time, threading
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+import contextlib, hashlib, json, os, platform, re, tempfile, time, threading
+from html import unescape
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from urllib.parse import urljoin, unquote
 
 import requests
-from bs4 import BeautifulSoup
-from urllib3.exceptions import InsecureRequestWarning
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.exceptions import InsecureRequestWarning, NewConnectionError
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is used when missing
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch the same exception either way
+_json_loads = orjson.loads if orjson is not None else json.loads
 
 DRAWERS = ["Multi-Purpose Tray", "Drawer 1", "Drawer 2", "Drawer 3", "Drawer 4"]
 TONERS  = ["Cyan", "Magenta", "Yellow", "Black"]
 ICON_MAP = {"00": "Empty", "04": "1 Bar", "07": "2 Bar", "10": "3 Bar"}
 BAR_MAP  = {"0": "Empty", "1": "1 Bar", "2": "2 Bar", "3": "3 Bar"}
 
-def soup(html: str) -> BeautifulSoup:
-    return BeautifulSoup(html or "", "html.parser")
+_TONER_VOL_RES = {c: re.compile(rf'"{k}"\s*:\s*"(\d+)"') for k, c in [("tonerCVol", "Cyan"), ("tonerMVol", "Magenta"), ("tonerYVol", "Yellow"), ("tonerKVol", "Black")]}
+_PAP_ICON_RE = re.compile(r"pap_m(00|04|07|10)\.gif", re.I)
+_CST_ENTRY_RE = re.compile(r'"cstName"\s*:\s*"([^"\\]*)"\s*,\s*"remainPapVol"\s*:\s*"?(-?\d*)"?\s*,\s*"totalPapVol"\s*:\s*"?(-?\d*)"?')
+_STATUS_VARS_RE = re.compile(r"var\s+(tonerVolInfo|cstInfo)\s*=\s*([\{\[].*?[\}\]])\s*;", re.S)
+_STATUS_VAR_RES = {n: re.compile(rf"var\s+{n}\s*=\s*([\{{\[].*?[\}}\]])\s*;", re.S) for n in ("tonerVolInfo", "cstInfo")}
+_TONER_LABEL_RES = {c: re.compile(r'\b' + re.escape(c) + r'\b', re.I) for c in TONERS}
+_PCT_ALT_RE = re.compile(r"\d+%")
+_DIGITS_RE = re.compile(r"(\d+)")
+_MP_TRAY_RE = re.compile(r"multi|mp[ -]tray|bypass", re.I)
+_DRAWER_NO_RE = re.compile(r"drawer ([1-4])|^\s*([1-4])\s*\Z", re.I)
+_ERROR_KEYWORDS = ("toner", "paper", "jam", "error", "service", "install", "replace", "no ", "empty")
+_SENTENCE_RE = re.compile(r"[^.!?]+[.!?]")
+_ERROR_KEYWORD_RE = re.compile(r"\b(?:toner|paper|jam|error|service|install|replace|no\s\w+|empty)\b", re.I)
+_INVISIBLE_RE = re.compile(r"<!--.*?-->|<(script|style|head|title)\b[^>]*>.*?</\1\s*>", re.S | re.I)
+# only real tags: a bare "<" in text ("Toner level < 10%") must survive, as with get_text()
+_TAG_RE = re.compile(r"""</?[A-Za-z!?](?:[^>"']|"[^"]*"|'[^']*')*>""")
+# block-level tags end a sentence: table cells must not run together into one "error"
+_BLOCK_TAG_RE = re.compile(r"""</?(?:td|th|tr|table|p|div|br|li|ul|ol|h[1-6])\b(?:[^>"']|"[^"]*"|'[^']*')*>""", re.I)
+_WS_RE = re.compile(r"\s+")
+# matched against the lowered page, so firmware capitalisation doesn't matter
+_LOGIN_MARKERS = ("<title>login</title>", 'name="login"')
+_STATUS_MARKERS = ("tonervolinfo", "cstinfo", "error information", "consumables")
+# the JS variables the parsers read; nav/portal pages can mention "consumables" without them
+_STATUS_DATA_MARKERS = ("tonervolinfo", "cstinfo")
+
+# lxml goes through PyPy's slow C-API emulation; the pure-Python parser JITs well there
+_SOUP_PARSER = "html.parser" if platform.python_implementation() == "PyPy" else "lxml"
+
+# The table fallbacks only read <tr> subtrees and the login probe only its form fields
+_ROWS_ONLY = SoupStrainer("tr")
+_LOGIN_ONLY = SoupStrainer(["form", "input"])
+
+def soup(html: str, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+    return BeautifulSoup(html or "", _SOUP_PARSER, parse_only=parse_only)
 
 def _dedupe_preserve(seq: List[str]) -> List[str]:
-    seen=set(); out=[]
-    for x in seq:
-        if x and x not in seen:
-            seen.add(x); out.append(x)
-    return out
+    # dicts keep insertion order, so this drops repeats (and blanks) while keeping first-seen order
+    return list(dict.fromkeys(x for x in seq if x))
 
 def _norm_tray_name(raw: str) -> str:
-    r = (raw or "").lower()
-    if "multi" in r: return "Multi-Purpose Tray"
-    if any(s in r for s in ["mp tray", "mp-tray", "bypass"]): return "Multi-Purpose Tray"
-    for i in range(1, 5):
-        if f"drawer {i}" in r or r.strip() == str(i): return f"Drawer {i}"
-    return (raw or "").strip()
+    raw = raw or ""
+    # multi-purpose wins over a drawer number, as with the old chained checks
+    if _MP_TRAY_RE.search(raw): return "Multi-Purpose Tray"
+    if m := _DRAWER_NO_RE.search(raw): return f"Drawer {m.group(1) or m.group(2)}"
+    return raw.strip()
+
+_insecure_warnings_disabled = False
+
+def _disable_insecure_warnings() -> None:
+    # process-wide; once is enough no matter how many worker sessions get made
+    global _insecure_warnings_disabled
+    if not _insecure_warnings_disabled:
+        urllib3.disable_warnings(InsecureRequestWarning)
+        _insecure_warnings_disabled = True
 
 def make_session(verify_ssl: bool, user_agent: str) -> requests.Session:
     if not verify_ssl:
-        requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+        _disable_insecure_warnings()
     s = requests.Session()
     s.verify = verify_ssl
+    # requests already sends keep-alive + gzip. A session serves one thread and one printer at a time,
+    # and each printer is visited once per run, so only the current host's connection is worth keeping.
+    # no retries: a failed candidate just falls through to the next one, and a dead printer fails fast
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    # the login flow needs a hop or two; a misconfigured loop shouldn't get the default 30
+    s.max_redirects = 5
     if user_agent:
         s.headers.update({"User-Agent": user_agent})
     return s
 
+def _response_text(r: requests.Response) -> str:
+    # r.text falls back to charset detection over the whole body when the printer sends no
+    # charset; decode once with the declared encoding (or UTF-8) instead
+    try:
+        return r.content.decode(r.encoding or "utf-8", errors="replace")
+    except LookupError:  # unknown charset label
+        return r.content.decode("utf-8", errors="replace")
+
 def login_if_needed(s: requests.Session, base: str, timeout: int) -> str:
     r = s.get(urljoin(base, "/"), allow_redirects=True, timeout=timeout)
     r.raise_for_status()
-    if "<title>Login</title>" in r.text or 'name="login"' in r.text:
-        doc = soup(r.text)
-        form = doc.find("form", {"name": "login"})
-        action = form.get("action", "/login") if form else "/login"
-        uri_el = doc.find("input", {"name": "uri"})
-        uri = uri_el.get("value", "/") if uri_el else "/"
-        s.post(urljoin(base, action), data={"userID": "", "password": "", "uri": uri}, allow_redirects=True, timeout=timeout).raise_for_status()
-        target = urljoin(base, unquote(uri)) if unquote(uri).startswith("/") else unquote(uri)
-        r = s.get(target, allow_redirects=True, timeout=timeout); r.raise_for_status()
-    return r.text
+    page = _response_text(r)
+    if _is_login_page(page):
+        page = _submit_login(s, base, timeout, page)
+    return page
+
+def _submit_login(s: requests.Session, base: str, timeout: int, page: str) -> str:
+    # page is a login form already; post it and return where it lands
+    doc = soup(page, _LOGIN_ONLY)
+    form = doc.find("form", {"name": "login"})
+    action = form.get("action", "/login") if form else "/login"
+    uri_el = doc.find("input", {"name": "uri"})
+    uri = uri_el.get("value", "/") if uri_el else "/"
+    s.post(urljoin(base, action), data={"userID": "", "password": "", "uri": uri}, allow_redirects=True, timeout=timeout).raise_for_status()
+    target = urljoin(base, unquote(uri)) if unquote(uri).startswith("/") else unquote(uri)
+    r = s.get(target, allow_redirects=True, timeout=timeout); r.raise_for_status()
+    return _response_text(r)
+
+def _page_kind(html: str) -> str:
+    # "login", "data" (carries the status variables), "status" (other status markers) or "other";
+    # the one place a page gets lowered
+    lowered = html.lower()
+    if any(k in lowered for k in _LOGIN_MARKERS):
+        return "login"
+    if any(k in lowered for k in _STATUS_DATA_MARKERS):
+        return "data"
+    if any(k in lowered for k in _STATUS_MARKERS):
+        return "status"
+    return "other"
 
 def _is_login_page(html: str) -> bool:
-    return "<title>Login</title>" in html or 'name="login"' in html
+    return _page_kind(html) == "login"
+
+def _host_unreachable(exc: requests.RequestException) -> bool:
+    # connect timed out or was refused: every other path on this host will fail the same way
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    return isinstance(exc, requests.ConnectionError) and isinstance(getattr(exc.args[0] if exc.args else None, "reason", None), NewConnectionError)
 
 def fetch_best_status_html(s: requests.Session, base: str, timeout: int) -> str:
+    return _probe_status_page(s, base, timeout)[0]
+
+def _probe_status_page(s: requests.Session, base: str, timeout: int) -> Tuple[str, str]:
+    # (html, _page_kind(html)), so callers don't classify the page a second time
     ts = str(int(time.time() * 1000))
     candidates = [
         f"/rps/dstatus.cgi?CorePGTAG=11&PageFlag=d_tops.tpl&Dummy={ts}",
@@ -68,76 +159,122 @@ def fetch_best_status_html(s: requests.Session, base: str, timeout: int) -> str:
     ]
     # fail-fast timeouts per request (connect, read)
     to = (min(2, timeout), min(3, timeout))
-    last_ok = ""
-    with futures.ThreadPoolExecutor(max_workers=len(candidates)) as ex:
-        future_list = [ex.submit(lambda p: s.get(urljoin(base, p), allow_redirects=True, timeout=to), path) for path in candidates]
-        for fut in futures.as_completed(future_list):
-            try:
-                r = fut.result()
-            except requests.RequestException:
-                continue
-            if r.ok:
-                html = r.text
-                last_ok = html
-                if any(k in html for k in ("tonerVolInfo", "cstInfo", "Error Information", "Consumables")) and not _is_login_page(html):
-                    return html
-    return last_ok
-
-def extract_json_var(name: str, html: str) -> Optional[str]:
-    m = re.search(rf"var\s+{re.escape(name)}\s*=\s*([\{{\[].*?[\}}\]])\s*;", html, re.S)
-    return m.group(1) if m else None
-
-def parse_toner(html: str) -> dict:
+    # fallback when neither a status nor a login page shows up: the first page that loaded
+    best: Tuple[str, str] = ("", "other")
+    # most specific first; on a healthy printer the first GET is the only one
+    for path in candidates:
+        try:
+            r = s.get(urljoin(base, path), allow_redirects=True, timeout=to)
+        except requests.RequestException as e:
+            if _host_unreachable(e):
+                break  # a dead printer costs one connect timeout, not one per candidate
+            continue
+        if r.ok:
+            html = _response_text(r)
+            kind = _page_kind(html)
+            # a login page means every candidate is behind it: hand it back so the caller logs in
+            if kind != "other":
+                return html, kind
+            if not best[0]:
+                best = html, kind
+    return best
+
+def extract_status_vars(html: str) -> Dict[str, str]:
+    # tonerVolInfo and cstInfo in one scan; first declaration wins
+    out: Dict[str, str] = {}
+    for m in _STATUS_VARS_RE.finditer(html):
+        out.setdefault(m.group(1), m.group(2))
+    # a declaration without its own ";" runs on into the next one, which the non-overlapping
+    # scan then never sees; look for any name it missed on its own
+    for name, rx in _STATUS_VAR_RES.items():
+        if name not in out and (m := rx.search(html)):
+            out[name] = m.group(1)
+    return out
+
+def parse_toner(html: str, json_vars: Optional[Dict[str, str]] = None, doc: Optional[BeautifulSoup] = None) -> dict:
     vals = {c: "N/A" for c in TONERS}
-    js = extract_json_var("tonerVolInfo", html)
+    js = (json_vars if json_vars is not None else extract_status_vars(html)).get("tonerVolInfo")
     if js:
-        for k, c in [("tonerCVol", "Cyan"), ("tonerMVol", "Magenta"), ("tonerYVol", "Yellow"), ("tonerKVol", "Black")]:
-            m = re.search(rf'"{k}"\s*:\s*"(\d+)"', js)
+        for c, rx in _TONER_VOL_RES.items():
+            m = rx.search(js)
             if m: vals[c] = m.group(1)
         return vals
-    doc = soup(html)
+    if doc is None:
+        doc = soup(html, _ROWS_ONLY)
     for color in TONERS:
-        tag = doc.find(["th", "td"], string=re.compile(r'\b' + re.escape(color) + r'\b', re.I))
+        tag = doc.find(["th", "td"], string=_TONER_LABEL_RES[color])
         if tag and (parent_row := tag.find_parent("tr")):
-            img = parent_row.find("img", alt=re.compile(r"\d+%"))
+            img = parent_row.find("img", alt=_PCT_ALT_RE)
             if img and 'alt' in img.attrs:
-                if m := re.search(r"(\d+)", img['alt']):
+                if m := _DIGITS_RE.search(img['alt']):
                     vals[color] = m.group(1)
     return vals
 
-def parse_paper(html: str) -> dict:
+def _cst_entries_json(js: str) -> Optional[List[Tuple[str, int, int]]]:
+    # (cstName, remainPapVol, totalPapVol) per entry, or None if the blob isn't valid JSON
+    try:
+        data = _json_loads(js)
+    except json.JSONDecodeError:
+        return None
+    items = list(data.values()) if isinstance(data, dict) else (data if isinstance(data, list) else [])
+    return [(str(e.get("cstName", "")), int(str(e.get("remainPapVol", "0") or 0)), int(str(e.get("totalPapVol", "0") or 0)))
+            for e in items if isinstance(e, dict)]
+
+def parse_paper(html: str, json_vars: Optional[Dict[str, str]] = None, doc: Optional[BeautifulSoup] = None) -> dict:
     paper = {k: "N/A" for k in DRAWERS}
-    doc = soup(html)
-    if js := extract_json_var("cstInfo", html):
-        try:
-            data = json.loads(js)
-            items = list(data.values()) if isinstance(data, dict) else (data if isinstance(data, list) else [])
-            for entry in items:
-                if isinstance(entry, dict):
-                    name = _norm_tray_name(str(entry.get("cstName", "")))
-                    remain, total = int(str(entry.get("remainPapVol", "0") or 0)), int(str(entry.get("totalPapVol", "0") or 0))
-                    bars = max(0, min(3, min(remain, 3 if total >= 3 else total)))
-                    if name in paper: paper[name] = BAR_MAP.get(str(bars), "N/A")
+    if js := (json_vars if json_vars is not None else extract_status_vars(html)).get("cstInfo"):
+        # the firmware writes the three fields we need in a fixed order; pull them straight out
+        # of the blob, and fall back to a full json.loads unless every entry has that layout
+        found = _CST_ENTRY_RE.findall(js)
+        if found and len(found) == js.count('"cstName"'):
+            entries = [(name, int(remain or 0), int(total or 0)) for name, remain, total in found]
+        else:
+            entries = _cst_entries_json(js)
+        if entries is not None:
+            for raw_name, remain, total in entries:
+                name = _norm_tray_name(raw_name)
+                bars = max(0, min(3, min(remain, 3 if total >= 3 else total)))
+                if name in paper: paper[name] = BAR_MAP.get(str(bars), "N/A")
             return paper
-        except json.JSONDecodeError:
-            pass
-    for tr in doc.find_all("tr"):
-        if m_icon := re.search(r"pap_m(00|04|07|10)\.gif", str(tr), re.I):
-            if label_cell := (tr.find("th") or tr.find("td")):
-                key = _norm_tray_name(label_cell.get_text(" ", strip=True))
-                if key in paper:
-                    paper[key] = ICON_MAP.get(m_icon.group(1), "N/A")
+    # only build the DOM when cstInfo is missing or unparsable
+    if doc is None:
+        doc = soup(html, _ROWS_ONLY)
+    # one pass over the drawer icons, then up to their row; most rows on the page carry none
+    seen_rows = set()
+    for img in doc.find_all("img", src=_PAP_ICON_RE):
+        tr = img.find_parent("tr")
+        if tr is None or id(tr) in seen_rows:
+            continue  # first icon in a row decides, as before
+        seen_rows.add(id(tr))
+        m_icon = _PAP_ICON_RE.search(img["src"])
+        if label_cell := (tr.find("th") or tr.find("td")):
+            key = _norm_tray_name(label_cell.get_text(" ", strip=True))
+            if key in paper:
+                paper[key] = ICON_MAP.get(m_icon.group(1), "N/A")
     return paper
 
-def parse_explicit_errors(doc: BeautifulSoup) -> List[str]:
-    body_text = doc.body.get_text(" ", strip=True) if doc.body else ""
-    error_keywords = r'\b(toner|paper|jam|error|service|install|replace|no\s\w+|empty)\b'
-    sentences = re.findall(rf'[^.!?]*{error_keywords}[^.!?]*[.!?]', body_text, re.I)
+def _visible_blocks(html: str) -> List[str]:
+    # body text without building a DOM, one string per block-level element: drop
+    # head/title/script/style/comments, split at block tags, then strip the remaining tags.
+    # No slicing at <body>: parsers move stray content before it into the body anyway
+    text = _INVISIBLE_RE.sub(" ", html)
+    blocks = (_WS_RE.sub(" ", unescape(_TAG_RE.sub(" ", b))).strip() for b in _BLOCK_TAG_RE.split(text))
+    return [b for b in blocks if b]
+
+def parse_explicit_errors(html: str) -> List[str]:
+    blocks = _visible_blocks(html or "")
+    # substring tests are much cheaper than the sentence regex and rule out most clean pages
+    lowered = " ".join(blocks).lower()
+    if not any(k in lowered for k in _ERROR_KEYWORDS):
+        return []
+    # split into sentences once, then keep the ones naming a keyword; a single pattern with
+    # [^.!?]* on both sides of the keyword backtracks badly on long keyword-free sentences
     cleaned = []
-    for s in sentences:
-        s2 = s.strip()
-        if "no error" in s2.lower(): continue
-        cleaned.append(s2)
+    for block in blocks:
+        for m in _SENTENCE_RE.finditer(block):
+            s2 = m.group().strip()
+            if not _ERROR_KEYWORD_RE.search(s2) or "no error" in s2.lower(): continue
+            cleaned.append(s2)
     return _dedupe_preserve(cleaned)
 
 def derive_fallback_errors(toner: dict, paper: dict) -> List[str]:
@@ -150,15 +287,26 @@ def derive_fallback_errors(toner: dict, paper: dict) -> List[str]:
             errors.append(f"{drawer} is empty.")
     return errors
 
-def fetch_printer_status(s: requests.Session, base: str, timeout: int) -> Dict[str, Any]:
-    html = fetch_best_status_html(s, base, timeout)
-    if _is_login_page(html):
-        _ = login_if_needed(s, base, timeout)
-        html = fetch_best_status_html(s, base, timeout)
-    doc = soup(html)
-    toner_raw = parse_toner(html)
-    paper = parse_paper(html)
-    errors = parse_explicit_errors(doc)
+def fetch_status_html(s: requests.Session, base: str, timeout: int) -> str:
+    # network stage: status page HTML, logging in first if the printer asks for it
+    html, kind = _probe_status_page(s, base, timeout)
+    if kind == "login":
+        # the probe already returned the login form, so log in from it directly. Keep the page we
+        # land on only if it carries the status variables; a portal page that merely links
+        # "Consumables" would parse as all N/A, so probe again (dstatus.cgi first) otherwise
+        html = _submit_login(s, base, timeout, html)
+        if _page_kind(html) != "data":
+            html = _probe_status_page(s, base, timeout)[0]
+    return html
+
+def parse_printer_html(html: str) -> Dict[str, Any]:
+    # parse stage: pure str -> dict, no session or I/O
+    json_vars = extract_status_vars(html)
+    # one row tree shared by both table fallbacks, built only if either JS variable is missing
+    doc = None if json_vars.get("tonerVolInfo") and json_vars.get("cstInfo") else soup(html, _ROWS_ONLY)
+    toner_raw = parse_toner(html, json_vars, doc)
+    paper = parse_paper(html, json_vars, doc)
+    errors = parse_explicit_errors(html)
     has_explicit_toner_error = any("toner" in e.lower() for e in errors)
     has_explicit_paper_error = any("paper" in e.lower() or "drawer" in e.lower() for e in errors)
     for e in derive_fallback_errors(toner_raw, paper):
@@ -169,15 +317,81 @@ def fetch_printer_status(s: requests.Session, base: str, timeout: int) -> Dict[s
     toner_pct = {k: (v + "%" if isinstance(v, str) and v.isdigit() else v) for k, v in toner_raw.items()}
     return {"toner": toner_pct, "paper": paper, "errors": _dedupe_preserve(errors)}
 
-@dataclass
+# base_url -> (digest of the last page, its parse result); one entry per printer, whatever the fleet size
+_last_parse: Dict[str, Tuple[bytes, Dict[str, Any]]] = {}
+
+def parse_printer_html_cached(base: str, html: str) -> Dict[str, Any]:
+    # server mode re-scrapes the same fleet; a printer whose page is unchanged skips the parse.
+    # only a digest is kept, not the page itself
+    digest = hashlib.blake2b(html.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    hit = _last_parse.get(base)
+    if hit is not None and hit[0] == digest:
+        d = hit[1]
+    else:
+        d = parse_printer_html(html)
+        _last_parse[base] = (digest, d)
+    # hand out fresh containers so callers never share (or mutate) the cached result
+    return {"toner": dict(d["toner"]), "paper": dict(d["paper"]), "errors": list(d["errors"])}
+
+def fetch_printer_status(s: requests.Session, base: str, timeout: int) -> Dict[str, Any]:
+    return parse_printer_html_cached(base, fetch_status_html(s, base, timeout))
+
 class Printer:
-    name: str
-    base_url: str
-    address: str | None = None
+    # hand-written __slots__ rather than @dataclass(slots=True), which needs Python 3.10
+    __slots__ = ("name", "base_url", "address")
+
+    def __init__(self, name: str, base_url: str, address: str | None = None) -> None:
+        self.name = name
+        self.base_url = base_url
+        self.address = address
+
+    def __repr__(self) -> str:
+        return f"Printer(name={self.name!r}, base_url={self.base_url!r}, address={self.address!r})"
+
+def load_json(path: str) -> Any:
+    with open(path, "rb") as f:
+        return _json_loads(f.read())
 
 def load_config(path: str) -> dict:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return load_json(path)
+
+# read once at import: os.umask() can only be queried by setting it, which isn't thread-safe later
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+@contextlib.contextmanager
+def _atomic_open(path: str, mode: str, **kwargs: Any) -> Iterator[IO]:
+    # write to a uniquely named file next to path, then os.replace it in, so a reader never sees a
+    # half-written file and concurrent runs don't share a temp name; a failed write leaves nothing behind
+    f = tempfile.NamedTemporaryFile(mode, dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False, **kwargs)
+    try:
+        with f:
+            yield f
+        # mkstemp creates the file 0600; give it the mode the target has (or a plain open() would)
+        try:
+            mode_bits = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode_bits = 0o666 & ~_UMASK
+        os.chmod(f.name, mode_bits)
+        os.replace(f.name, path)
+    except BaseException:
+        try:
+            os.unlink(f.name)
+        except FileNotFoundError:
+            pass
+        raise
+
+def save_json(path: str, obj: Any) -> None:
+    if orjson is not None:
+        with _atomic_open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with _atomic_open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(obj, indent=2, ensure_ascii=False))
+
+def save_text(path: str, chunks: Iterable[str]) -> None:
+    with _atomic_open(path, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.writelines(chunks)
 
 def load_printers_from_config(cfg: Dict[str, Any]) -> List[Printer]:
     out=[]
@@ -186,38 +400,56 @@ def load_printers_from_config(cfg: Dict[str, Any]) -> List[Printer]:
             out.append(Printer(name=p.get("name", p["url"]), base_url=p["url"], address=p.get("address")))
     return out
 
-_tls = threading.local()
-
-def _session_for_thread(verify_ssl: bool, user_agent: str) -> requests.Session:
-    s = getattr(_tls, "session", None)
-    if s is None:
-        s = make_session(verify_ssl, user_agent)
-        _tls.session = s
-    return s
-
-def collect_all(printers: List[Printer], http_cfg: dict, max_workers: int | None = None) -> List[Dict[str, Any]]:
+def collect_all(printers: List[Printer], http_cfg: dict, max_workers: int | None = None,
+                parse_processes: int | None = None) -> List[Dict[str, Any]]:
     timeout = int(http_cfg.get("timeout_seconds", 15))
     verify_ssl = bool(http_cfg.get("verify_ssl", False))
     user_agent = str(http_cfg.get("user_agent", "Mozilla/5.0"))
 
     if not max_workers:
-        max_workers = max(4, min(20, len(printers)))
+        # each worker mostly waits on a socket, so let one wave cover the fleet; the cap is
+        # only there to keep thread count sane. "http.max_workers" in config.json overrides it
+        max_workers = int(http_cfg.get("max_workers") or 0) or max(4, min(64, len(printers)))
 
     rows: List[Dict[str, Any]] = []
+    # one session per worker thread (requests.Session isn't thread-safe), all closed when the run ends
+    tls = threading.local()
+    sessions: List[requests.Session] = []
+
+    def session_for_thread() -> requests.Session:
+        s = getattr(tls, "session", None)
+        if s is None:
+            s = tls.session = make_session(verify_ssl, user_agent)
+            sessions.append(s)
+        return s
+
+    # optional process pool for the parse stage, so big pages aren't parsed under the fetch threads' GIL.
+    # off unless "http.parse_processes" in config.json (or the argument) asks for it
+    parse_processes = parse_processes or int(http_cfg.get("parse_processes") or 0)
+    parse_pool = futures.ProcessPoolExecutor(max_workers=parse_processes) if parse_processes else None
 
     def task(pr: Printer):
-        s = _session_for_thread(verify_ssl, user_agent)
-        return pr, fetch_printer_status(s, pr.base_url, timeout)
-
-    with futures.ThreadPoolExecutor(max_workers=max_workers) as ex:
-        futs = {ex.submit(task, pr): pr for pr in printers}
-        for fut in futures.as_completed(futs):
-            pr = futs[fut]
-            row = {"name": pr.name, "url": pr.base_url, "address": pr.address or "", "errors": [], "toner": {}, "paper": {}}
-            try:
-                _pr, data = fut.result()
-                row.update(data)
-            except Exception as e:
-                row["errors"].append(f"Failed to fetch: {e}")
-            rows.append(row)
+        try:
+            html = fetch_status_html(session_for_thread(), pr.base_url, timeout)
+            data = parse_pool.submit(parse_printer_html, html).result() if parse_pool else parse_printer_html_cached(pr.base_url, html)
+            return pr, data, None
+        except Exception as e:
+            return pr, None, f"Failed to fetch: {e}"
+
+    try:
+        # map() keeps config order, so the report lists printers the same way every run
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as ex:
+            for pr, data, err in ex.map(task, printers):
+                # built in one go, in the key order the JSON file and report have always used
+                if err is None:
+                    rows.append({"name": pr.name, "url": pr.base_url, "address": pr.address or "",
+                                 "errors": data["errors"], "toner": data["toner"], "paper": data["paper"]})
+                else:
+                    rows.append({"name": pr.name, "url": pr.base_url, "address": pr.address or "",
+                                 "errors": [err], "toner": {}, "paper": {}})
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+        for s in sessions:
+            s.close()
     return rows
\ No newline at end of file
@@ -3,8 +3,8 @@ from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os, datetime
 
-from core import load_config, load_printers_from_config, collect_all
-from app_html import build_html
+from core import load_config, load_printers_from_config, collect_all, load_json, save_json, save_text
+from app_html import build_html_iter
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 app = Flask(__name__, static_folder=BASE_DIR, static_url_path="")
@@ -17,16 +17,13 @@ def api_run():
     try:
         cfg = load_config(p("config.json"))
         printers = load_printers_from_config(cfg)
-        rows = collect_all(printers, cfg.get("http", {}), max_workers=8)
+        rows = collect_all(printers, cfg.get("http", {}))
 
         # persist latest
         json_path = p("app-printers.json")
         html_path = p("app-report.html")
-        with open(json_path, "w", encoding="utf-8") as f:
-            import json; json.dump(rows, f, indent=2, ensure_ascii=False)
-        html = build_html(rows, banner_src="vcutsbanner.png", title="Printer Status")
-        with open(html_path, "w", encoding="utf-8") as f:
-            f.write(html)
+        save_json(json_path, rows)
+        save_text(html_path, build_html_iter(rows, banner_src="vcutsbanner.png", title="Printer Status"))
 
         return jsonify({
             "ok": True,
@@ -41,10 +38,8 @@ def api_run():
 
 @app.get("/api/last")
 def api_last():
-    import json
     try:
-        with open(p("app-printers.json"), "r", encoding="utf-8") as f:
-            rows = json.load(f)
+        rows = load_json(p("app-printers.json"))
         return jsonify({"ok": True, "rows": rows}), 200
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 404